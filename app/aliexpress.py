@@ -1,64 +1,160 @@
 import json
 import random
 import asyncio
-import math
-from typing import Dict, List, Optional
-from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+import os
+import re
+import ssl
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Union
+from urllib.parse import urlparse, parse_qsl
+import certifi
 import httpx
-from parsel import Selector
+from selectolax.lexbor import LexborHTMLParser
 import logging
+import orjson
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_json_decoder = json.JSONDecoder()
+
+# Built once so clients do not reload the CA bundle on every instantiation
+SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where())
+
+ITEM_URL_PREFIX = "https://www.aliexpress.com/item/"
+_ITEM_ID_RE = re.compile(r'/item/(\d+)\.html')
+_PRICE_RE = re.compile(r'\d[\d,]*(?:\.\d+)?')
+
+# CSS selectors for the rendered product cards used by extract_search_cards
+_CARD_SEL = 'div.search-item-card-wrapper-gallery'
+_CARD_LINK_SEL = 'a.search-card-item'
+_CARD_TITLE_SEL = 'h3.lq_jl'
+_CARD_PRICE_SEL = 'div.lq_j3 span'
+_CARD_IMAGE_SEL = 'img.l9_be'
+
+# Upper bound on page requests in flight for a single search
+MAX_CONCURRENT_PAGES = 4
+
+USER_AGENTS = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+HEADER_TEMPLATE = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Cache-Control": "max-age=0",
+    "Cookie": "aep_usuc_f=site=glo&c_tp=USD&region=US&b_locale=en_US"
+}
+
 def get_headers() -> Dict[str, str]:
     """
     Generate request headers with a random user agent to prevent blocking.
     Includes necessary cookies and headers for AliExpress requests.
     """
-    user_agents = [
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:120.0) Gecko/20100101 Firefox/120.0",
-        "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    ]
-    return {
-        "User-Agent": random.choice(user_agents),
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "none",
-        "Sec-Fetch-User": "?1",
-        "Cache-Control": "max-age=0",
-        "Cookie": "aep_usuc_f=site=glo&c_tp=USD&region=US&b_locale=en_US"
-    }
-
-def extract_search(response) -> Dict:
+    headers = HEADER_TEMPLATE.copy()
+    headers["User-Agent"] = random.choice(USER_AGENTS)
+    return headers
+
+def create_client() -> httpx.AsyncClient:
+    """
+    Create an HTTP/2 client tuned for AliExpress scraping.
+    Concurrent page fetches are multiplexed over kept-alive connections.
+    Environment probing is disabled, so a proxy is only used when SCRAPER_PROXY is set.
+    """
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        http2=True,
+        verify=SSL_CONTEXT,
+        trust_env=False,
+        proxies=os.getenv("SCRAPER_PROXY") or None,
+        headers=HEADER_TEMPLATE,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50, keepalive_expiry=30.0)
+    )
+
+def extract_search(response) -> Optional[Dict]:
     """
     Extract product data from AliExpress search page response.
     The data is stored in a JavaScript variable '_init_data_' within a script tag.
+    The payload is located with plain string searches and decoded in place, so
+    the page is never built into a DOM tree or scanned by a backtracking regex.
     
     Returns:
-        Dict containing the parsed product data or empty product list if extraction fails
+        Dict containing the parsed product data, an empty product list if decoding fails,
+        or None if the page has no '_init_data_' payload
     """
     try:
-        sel = Selector(response.text)
-        script_with_data = sel.xpath('//script[contains(.,"_init_data_=")]')
-        if not script_with_data:
-            logger.error("No _init_data_ script found in page")
-            return {"data": {"root": {"fields": {"mods": {"itemList": {"content": []}}}}}}
-            
-        data = json.loads(script_with_data.re(r'_init_data_\s*=\s*{\s*data:\s*({.+}) }')[0])
+        # Work on the raw body so the page is never decoded into one large str
+        html = response.content
+        start = html.find(b'_init_data_=')
+        if start == -1:
+            return None
+
+        start = html.find(b'{', html.find(b'data:', start))
+        end = html.find(b'</script>', start)
+        if end == -1:
+            end = len(html)
+        script = html[start:end]
+        try:
+            # Fast path: the object ends just before the `{ data: ... }` wrapper's closing brace
+            data = orjson.loads(script[:script.rfind(b'}')])
+        except orjson.JSONDecodeError:
+            # Other code follows the wrapper in the same tag; let the decoder find the object's end
+            data, _ = _json_decoder.raw_decode(script.decode('utf-8', errors='replace'))
         return data['data']['root']['fields']
     except Exception as e:
-        logger.error(f"Error in extract_search: {str(e)}")
+        logger.error("Error in extract_search: %s", e)
         return {"mods": {"itemList": {"content": []}}}
 
+def extract_search_cards(html: Union[str, bytes]) -> List[Dict]:
+    """
+    Extract product data from the rendered product cards of a search page.
+    Only used when the page does not embed the '_init_data_' payload; the cards
+    carry no store details, so those products are returned without a store.
+    
+    Returns:
+        List of parsed product dictionaries in the same shape as parse_search
+    """
+    tree = LexborHTMLParser(html)
+    parsed = []
+
+    for card in tree.css(_CARD_SEL):
+        link = card.css_first(_CARD_LINK_SEL)
+        title = card.css_first(_CARD_TITLE_SEL)
+        image = card.css_first(_CARD_IMAGE_SEL)
+        if link is None or title is None or image is None:
+            continue
+        match = _ITEM_ID_RE.search(link.attributes.get('href') or '')
+        price = _PRICE_RE.search(''.join(span.text(strip=True) for span in card.css(_CARD_PRICE_SEL)))
+        if not match or not price:
+            continue
+
+        product_id = match.group(1)
+        parsed.append({
+            "id": product_id,
+            "url": ITEM_URL_PREFIX + product_id + ".html",
+            "type": "natural",
+            "title": title.text(strip=True),
+            "price": float(price.group().replace(',', '')),
+            "currency": "USD",
+            "trade": None,
+            "thumbnail": (image.attributes.get('src') or '').lstrip("/"),
+            "store": None,
+        })
+
+    logger.debug("Extracted %d products from product cards", len(parsed))
+    return parsed
+
 def parse_search(response):
     """
     Parse AliExpress search results into a standardized format.
@@ -69,6 +165,10 @@ def parse_search(response):
     """
     try:
         data = extract_search(response)
+        if data is None:
+            logger.info("No _init_data_ script found in page, falling back to product cards")
+            return extract_search_cards(response.content)
+
         parsed = []
         
         if not data.get("mods", {}).get("itemList", {}).get("content"):
@@ -77,9 +177,10 @@ def parse_search(response):
             
         for result in data["mods"]["itemList"]["content"]:
             try:
+                product_id = str(result["productId"])
                 parsed.append({
-                    "id": result["productId"],
-                    "url": f"https://www.aliexpress.com/item/{result['productId']}.html",
+                    "id": product_id,
+                    "url": ITEM_URL_PREFIX + product_id + ".html",
                     "type": result.get("productType", "natural"),
                     "title": result["title"]["displayTitle"],
                     "price": result["prices"]["salePrice"]["minPrice"],
@@ -94,15 +195,15 @@ def parse_search(response):
                     },
                 })
             except KeyError as e:
-                logger.warning(f"Missing required field in product data: {str(e)}")
+                logger.warning("Missing required field in product data: %s", e)
                 continue
                 
         return parsed
     except Exception as e:
-        logger.error(f"Error in parse_search: {str(e)}")
+        logger.error("Error in parse_search: %s", e)
         return []
 
-async def scrape_search(url: str, max_pages: int = 1) -> Dict:
+async def scrape_search(url: str, max_pages: int = 1, client: Optional[httpx.AsyncClient] = None) -> Dict:
     """
     Scrape AliExpress search results using their modern API format.
     Handles both old-style URLs (?SearchText=query) and new-style URLs (/wholesale-query.html).
@@ -110,6 +211,7 @@ async def scrape_search(url: str, max_pages: int = 1) -> Dict:
     Args:
         url: AliExpress search URL
         max_pages: Maximum number of pages to scrape (default: 1)
+        client: Shared HTTP client to reuse; a short-lived one is created if omitted
     
     Returns:
         Dict containing:
@@ -133,14 +235,15 @@ async def scrape_search(url: str, max_pages: int = 1) -> Dict:
         query = query.replace(" ", "-")
         sort_type = query_params.get('SortType', query_params.get('sorttype', 'default'))
 
-        async with httpx.AsyncClient(follow_redirects=True) as session:
-            session.headers.update(get_headers())
-            
+        headers = get_headers()
+        session_context = nullcontext(client) if client is not None else create_client()
+        async with session_context as session:
             # Fetch first page
-            logger.info(f"Scraping search query: {query} with sort: {sort_type}")
+            logger.info("Scraping search query: %s with sort: %s", query, sort_type)
             first_page = await session.get(
                 f"https://www.aliexpress.com/w/wholesale-{query}.html"
-                f"?sorttype={sort_type}&d=y&page=1"
+                f"?sorttype={sort_type}&d=y&page=1",
+                headers=headers
             )
             
             product_previews = parse_search(first_page)
@@ -151,22 +254,32 @@ async def scrape_search(url: str, max_pages: int = 1) -> Dict:
             # Fetch additional pages if requested
             if max_pages > 1:
                 try:
+                    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+
                     async def scrape_page(page):
-                        return await session.get(
-                            f"https://www.aliexpress.com/w/wholesale-{query}.html"
-                            f"?sorttype={sort_type}&d=y&page={page}"
-                        )
+                        async with semaphore:
+                            return await session.get(
+                                f"https://www.aliexpress.com/w/wholesale-{query}.html"
+                                f"?sorttype={sort_type}&d=y&page={page}",
+                                headers=headers
+                            )
 
-                    other_pages = await asyncio.gather(*[scrape_page(i) for i in range(2, max_pages + 1)])
-                    for response in other_pages:
+                    other_pages = await asyncio.gather(
+                        *[scrape_page(i) for i in range(2, max_pages + 1)],
+                        return_exceptions=True
+                    )
+                    for page, response in enumerate(other_pages, start=2):
+                        if isinstance(response, Exception):
+                            logger.warning("Failed to fetch page %d: %s", page, response)
+                            continue
                         product_previews.extend(parse_search(response))
                 except Exception as e:
-                    logger.error(f"Error scraping additional pages: {str(e)}")
+                    logger.error("Error scraping additional pages: %s", e)
 
             return {"products": product_previews, "total": len(product_previews)}
 
     except Exception as e:
-        logger.error(f"Error in scrape_search: {str(e)}")
+        logger.error("Error in scrape_search: %s", e)
         return {"products": [], "total": 0, "error": str(e)}
 
 async def run():
@@ -174,7 +287,7 @@ async def run():
     url = "https://www.aliexpress.com/w/wholesale-smartphone.html"
     results = await scrape_search(url, max_pages=1)
     print(f"Found {results['total']} products")
-    print(json.dumps(results['products'][:2], indent=2))
+    print(orjson.dumps(results['products'][:2], option=orjson.OPT_INDENT_2).decode())
 
 if __name__ == "__main__":
     asyncio.run(run())
\ No newline at end of file
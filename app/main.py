@@ -1,27 +1,69 @@
-from fastapi import FastAPI, HTTPException, Depends
-from typing import Optional, Dict, List, Any
-from pydantic import BaseModel, HttpUrl
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
+from starlette.middleware.base import BaseHTTPMiddleware
+from typing import Optional, Dict, List, Tuple, Union
+from pydantic import BaseModel, Field, TypeAdapter, field_validator
+from array import array
+from functools import lru_cache
+from pathlib import Path
+import asyncio
 import logging
-from urllib.parse import urlparse, parse_qsl
-from app.aliexpress import scrape_search
+import math
+import os
+import re
+import time
+import uuid
+import orjson
+from urllib.parse import unquote_plus
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from app.aliexpress import create_client, scrape_search
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open one HTTP client for the lifetime of the app.
+    Sharing it across requests keeps TLS connections alive between searches.
+    """
+    app.state.client = create_client()
+    yield
+    await app.state.client.aclose()
+    if isinstance(rate_limiter, RedisRateLimiter):
+        await rate_limiter.redis.aclose()
+
 app = FastAPI(
     title="AliExpress Scraper API",
     description="API for scraping product data from AliExpress",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+MAX_URL_LENGTH = 2048
+
 class SearchRequest(BaseModel):
     """
     Search request parameters.
     Accepts both old-style URLs (?SearchText=query) and new-style URLs (/wholesale-query.html)
     """
-    url: HttpUrl
-    max_pages: Optional[int] = 1
+    url: str
+    max_pages: int = Field(default=1, ge=1, le=10, description="Number of pages to scrape; capped at 10 to prevent abuse")
+
+    @field_validator('url')
+    @classmethod
+    def check_url(cls, url: str) -> str:
+        """Cheap sanity check; the search query itself is checked by has_search_query"""
+        url = url.strip()
+        if not url.startswith(('http://', 'https://')):
+            raise ValueError("url must start with http:// or https://")
+        if len(url) > MAX_URL_LENGTH:
+            raise ValueError(f"url cannot exceed {MAX_URL_LENGTH} characters")
+        return url
 
 class StoreResponse(BaseModel):
     """Store information from AliExpress"""
@@ -43,84 +85,226 @@ class ProductResponse(BaseModel):
     currency: str
     trade: Optional[str]
     thumbnail: str
-    store: StoreResponse
+    store: Optional[StoreResponse] = None
 
 class SearchResponse(BaseModel):
     """API response containing search results"""
     products: List[ProductResponse]
     total: int
 
+# SearchText value from the query string, and the segment after the last "wholesale-" in the path.
+# The path pattern skips the scheme and authority so a host like wholesale-foo.com does not count.
+SEARCH_TEXT_RE = re.compile(r'(?:^|&)SearchText=([^&]*)')
+WHOLESALE_PATH_RE = re.compile(r'^[a-zA-Z][\w+.-]*://[^/?#]*/[^?#]*wholesale-([^/?#]*)')
+
+@lru_cache(maxsize=1024)
+def has_search_query(url: str) -> bool:
+    """
+    Check whether a search URL carries a query, either as ?SearchText=query or /wholesale-query.html.
+    Matches precompiled patterns against the raw URL instead of parsing it into components.
+    Cached because clients tend to poll and retry the same URLs.
+    """
+    # Search only the query string: after the first '?' and before any fragment
+    for match in SEARCH_TEXT_RE.finditer(url.partition('#')[0].partition('?')[2]):
+        if unquote_plus(match.group(1)).strip():
+            return True
+
+    match = WHOLESALE_PATH_RE.match(url)
+    return bool(match and match.group(1).partition('.html')[0].strip('-'))
+
+# Validates a whole product list in one pass through pydantic-core
+PRODUCTS_ADAPTER = TypeAdapter(List[ProductResponse])
+
+def rate_limit_exceeded(current_requests: int, limit: int, window_size: int, wait_time: float) -> HTTPException:
+    """Build the 429 error shared by the in-memory and Redis rate limiters"""
+    logger.warning("Rate limit exceeded. Current requests: %d", current_requests)
+    # Round up so clients honouring Retry-After never come back before a slot is free
+    retry_after = max(1, math.ceil(wait_time))
+    return HTTPException(
+        status_code=429,
+        detail={
+            "error": "Rate limit exceeded",
+            "code": "agent.rate_limited",
+            "current_requests": current_requests,
+            "limit": limit,
+            "window_size": window_size,
+            "retry_after": retry_after
+        },
+        headers={"Retry-After": str(retry_after)}
+    )
+
 class RateLimiter:
     """
     Simple in-memory rate limiter using sliding window.
-    Tracks requests within a time window and rejects if limit is exceeded.
+    Keeps the timestamps of the last `requests_per_minute` admitted requests in a fixed-size ring buffer;
+    a request is rejected if the oldest of them is still inside the window.
     """
+    __slots__ = ('requests_per_minute', 'window_size', 'slots', 'head', '_lock')
+
     def __init__(self, requests_per_minute: int = 20, window_size: int = 60):
         self.requests_per_minute = requests_per_minute
         self.window_size = window_size
-        self.requests = []
-        logger.debug(f"Initialized RateLimiter with {requests_per_minute} requests per {window_size} seconds")
+        self.slots = array("d", [float("-inf")] * requests_per_minute)
+        self.head = 0
+        self._lock = asyncio.Lock()
+        logger.debug("Initialized RateLimiter with %d requests per %d seconds", requests_per_minute, window_size)
     
-    def _clean_old_requests(self):
-        """Remove requests older than the window size"""
-        now = datetime.now()
-        window_start = now - timedelta(seconds=self.window_size)
-        self.requests = [req_time for req_time in self.requests if req_time > window_start]
-        logger.debug(f"Cleaned old requests. Current count: {len(self.requests)}")
-    
-    async def check_rate_limit(self):
+    async def check_rate_limit(self, client_id: str = ""):
         """
         Check if the current request exceeds the rate limit.
+        The limit is global to this process, so client_id is ignored.
+        The check and the slot update happen under a lock so concurrent requests cannot both take the last slot.
         Raises HTTPException if limit is exceeded.
         """
-        now = datetime.now()
-        self._clean_old_requests()
-        
-        if len(self.requests) >= self.requests_per_minute:
-            window_start = now - timedelta(seconds=self.window_size)
-            oldest_request = min(self.requests)
-            wait_time = (window_start - oldest_request).total_seconds()
-            
-            logger.warning(f"Rate limit exceeded. Current requests: {len(self.requests)}")
-            raise HTTPException(
-                status_code=429,
-                detail={
-                    "error": "Rate limit exceeded",
-                    "current_requests": len(self.requests),
-                    "limit": self.requests_per_minute,
-                    "window_size": self.window_size,
-                    "retry_after": max(0, int(wait_time))
-                }
+        async with self._lock:
+            now = time.monotonic()
+            # The slot at head holds the oldest of the last N admitted requests
+            oldest_request = self.slots[self.head]
+
+            if now - oldest_request < self.window_size:
+                wait_time = self.window_size - (now - oldest_request)
+
+                raise rate_limit_exceeded(self.requests_per_minute, self.requests_per_minute, self.window_size, wait_time)
+
+            self.slots[self.head] = now
+            self.head = (self.head + 1) % self.requests_per_minute
+            logger.debug("Request allowed")
+
+class RedisRateLimiter:
+    """
+    Sliding-window rate limiter shared by all workers through Redis.
+    Each client gets a sorted set of request timestamps that rate_limit.lua trims, counts and appends to atomically,
+    so limits hold across `--workers N` and survive restarts.
+    """
+    __slots__ = ('requests_per_minute', 'window_size', 'redis', '_script')
+
+    def __init__(self, redis, requests_per_minute: int = 20, window_size: int = 60):
+        self.requests_per_minute = requests_per_minute
+        self.window_size = window_size
+        self.redis = redis
+        self._script = redis.register_script(RATE_LIMIT_SCRIPT)
+        logger.debug("Initialized RedisRateLimiter with %d requests per %d seconds", requests_per_minute, window_size)
+
+    async def check_rate_limit(self, client_id: str = ""):
+        """
+        Check if the current request from client_id exceeds the rate limit.
+        Fails open: if Redis cannot be reached the request is admitted and the error is logged,
+        so a Redis outage degrades rate limiting instead of taking the API down.
+        Raises HTTPException if limit is exceeded.
+        """
+        try:
+            allowed, current_requests, wait_ms = await self._script(
+                keys=[f"rate_limit:{client_id}"],
+                args=[self.window_size * 1000, self.requests_per_minute, uuid.uuid4().hex]
             )
-        
-        self.requests.append(now)
-        logger.debug(f"Request allowed. Current count: {len(self.requests)}")
+        except RedisError as e:
+            logger.error("Rate limit check failed, admitting request: %s", e)
+            return
+        if not allowed:
+            raise rate_limit_exceeded(current_requests, self.requests_per_minute, self.window_size, wait_ms / 1000)
 
-rate_limiter = RateLimiter(requests_per_minute=20, window_size=60)
+RATE_LIMIT_SCRIPT = (Path(__file__).parent / "rate_limit.lua").read_text()
+REDIS_URL = os.getenv("REDIS_URL")
 
-@app.get("/")
-async def root():
-    """API information endpoint"""
-    return {
-        "name": "AliExpress Scraper API",
-        "version": "1.0.0",
-        "description": "API for scraping product data from AliExpress",
-        "endpoints": {
-            "/search": {
-                "description": "Search for products using a URL",
-                "parameters": {
-                    "url": "AliExpress search URL (required)",
-                    "max_pages": "Maximum number of pages to scrape (1-10, default: 1)"
-                }
+if REDIS_URL:
+    rate_limiter = RedisRateLimiter(
+        Redis.from_url(REDIS_URL, max_connections=32, socket_connect_timeout=1, socket_timeout=1),
+        requests_per_minute=20,
+        window_size=60
+    )
+else:
+    rate_limiter = RateLimiter(requests_per_minute=20, window_size=60)
+
+class RateLimitMiddleware(BaseHTTPMiddleware):
+    """
+    Apply the rate limit to search requests before routing.
+    Rejected requests are answered with 429 without parsing or validating the request body.
+    """
+    def __init__(self, app, limiter: Union[RateLimiter, RedisRateLimiter], path: str = "/search"):
+        super().__init__(app)
+        self.limiter = limiter
+        self.path = path
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path == self.path and request.method == "POST":
+            try:
+                await self.limiter.check_rate_limit(request.client.host if request.client else "")
+            except HTTPException as e:
+                return ORJSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+        return await call_next(request)
+
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
+# Scrapes allowed to run at once, and how long a request may wait for a free slot
+MAX_CONCURRENT_SCRAPES = 4
+SCRAPE_QUEUE_TIMEOUT = 0.5
+scrape_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SCRAPES)
+
+# Serialized search responses keyed by (url, max_pages); results are stable for a minute or so
+search_cache: TTLCache = TTLCache(maxsize=1024, ttl=60)
+# Searches currently being scraped, so concurrent duplicates await the same result
+search_inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+
+# The API description never changes, so it is serialized once at import
+ROOT_BODY = orjson.dumps({
+    "name": "AliExpress Scraper API",
+    "version": "1.0.0",
+    "description": "API for scraping product data from AliExpress",
+    "endpoints": {
+        "/search": {
+            "description": "Search for products using a URL",
+            "parameters": {
+                "url": "AliExpress search URL (required)",
+                "max_pages": "Maximum number of pages to scrape (1-10, default: 1)"
             }
         }
     }
+})
+
+@app.get("/")
+async def root() -> Response:
+    """API information endpoint"""
+    return Response(content=ROOT_BODY, media_type="application/json")
+
+async def run_search(url: str, max_pages: int, client) -> bytes:
+    """
+    Scrape a search, validate the products and return the serialized SearchResponse body.
+    Raises HTTPException if the server is saturated or scraping fails.
+    """
+    # Fail fast instead of queueing scrapes without bound under load
+    try:
+        await asyncio.wait_for(scrape_semaphore.acquire(), timeout=SCRAPE_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=503,
+            detail={
+                "error": "Server busy",
+                "message": "Too many searches in progress, please retry shortly"
+            }
+        )
+
+    try:
+        results = await scrape_search(url, max_pages=max_pages, client=client)
+    finally:
+        scrape_semaphore.release()
+
+    if "error" in results:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Scraping failed",
+                "message": results["error"]
+            }
+        )
+
+    products = PRODUCTS_ADAPTER.validate_python(results["products"])
+    return orjson.dumps({"products": PRODUCTS_ADAPTER.dump_python(products), "total": results["total"]})
 
-@app.post("/search", response_model=SearchResponse)
+@app.post("/search", responses={200: {"model": SearchResponse}})
 async def search_products(
     request: SearchRequest,
-    _=Depends(rate_limiter.check_rate_limit)
-) -> SearchResponse:
+    http_request: Request
+) -> Response:
     """
     Search for products on AliExpress.
     
@@ -129,28 +313,19 @@ async def search_products(
     2. New style: /wholesale-query.html
     
     Args:
-        request: SearchRequest containing URL and optional max_pages
+        request: SearchRequest containing URL and optional max_pages (bounds are enforced by the model)
+        http_request: Incoming request, used to reach the shared HTTP client
         
     Returns:
-        SearchResponse with product list and total count
+        Product list and total count in the SearchResponse shape, as JSON bytes served from
+        the cache when the same search ran within the last minute
         
     Raises:
-        HTTPException: For invalid input, rate limiting, or scraping failures
+        HTTPException: For invalid input, too many concurrent searches, or scraping failures (rate limiting is handled by RateLimitMiddleware)
     """
     try:
         # Validate search query in URL
-        parsed_url = urlparse(str(request.url))
-        query_params = dict(parse_qsl(parsed_url.query))
-        
-        has_search = False
-        if query_params.get('SearchText', '').strip():
-            has_search = True
-        elif 'wholesale-' in parsed_url.path:
-            query = parsed_url.path.split('wholesale-')[-1].split('.html')[0]
-            if query.strip('-'):
-                has_search = True
-                
-        if not has_search:
+        if not has_search_query(request.url):
             raise HTTPException(
                 status_code=400,
                 detail={
@@ -159,42 +334,52 @@ async def search_products(
                 }
             )
 
-        # Validate pagination
-        if request.max_pages < 1:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Invalid max_pages",
-                    "message": "max_pages must be greater than 0"
-                }
-            )
-        if request.max_pages > 10:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Invalid max_pages",
-                    "message": "max_pages cannot exceed 10 to prevent abuse"
-                }
-            )
+        # Serve repeated searches from cache, or join a scrape already in progress
+        cache_key = (request.url, request.max_pages)
+        body = search_cache.get(cache_key)
+        if body is not None:
+            return Response(content=body, media_type="application/json")
+
+        inflight = search_inflight.get(cache_key)
+        if inflight is not None:
+            try:
+                body = await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Only the request that started the scrape went away; this one is still wanted
+                if not inflight.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                raise HTTPException(
+                    status_code=503,
+                    detail={
+                        "error": "Search interrupted",
+                        "message": "The shared search for this URL was cancelled, please retry"
+                    }
+                )
+            return Response(content=body, media_type="application/json")
+
+        future = asyncio.get_running_loop().create_future()
+        search_inflight[cache_key] = future
+        try:
+            body = await run_search(request.url, request.max_pages, http_request.app.state.client)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no other request was waiting
+            future.exception()
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            search_inflight.pop(cache_key, None)
+
+        search_cache[cache_key] = body
+        future.set_result(body)
+        return Response(content=body, media_type="application/json")
 
-        # Execute search
-        results = await scrape_search(str(request.url), max_pages=request.max_pages)
-        
-        if "error" in results:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Scraping failed",
-                    "message": results["error"]
-                }
-            )
-            
-        return SearchResponse(**results)
-        
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error in search_products: {str(e)}")
+        logger.error("Error in search_products: %s", e)
         raise HTTPException(
             status_code=500,
             detail={
@@ -0,0 +1,22 @@
+-- Sliding-window log rate limiter, run atomically by Redis.
+-- KEYS[1]: sorted set of request timestamps (ms) for one client
+-- ARGV[1]: window size in milliseconds
+-- ARGV[2]: maximum requests allowed within the window
+-- ARGV[3]: unique member id for this request
+-- Returns {allowed (1/0), requests in window, milliseconds until a slot frees up}
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window = tonumber(ARGV[1])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, now - window)
+local count = redis.call('ZCARD', KEYS[1])
+
+if count >= tonumber(ARGV[2]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return {0, count, tonumber(oldest[2]) + window - now}
+end
+
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], window)
+return {1, count + 1, 0}
@@ -0,0 +1,32 @@
+import pytest
+
+from app import aliexpress
+
+INIT_DATA = b'{"data":{"root":{"fields":{"mods":{"itemList":{"content":[]}},"note":"}"}}}}'
+
+
+class FakeResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+class FailingDecoder:
+    def raw_decode(self, *args, **kwargs):
+        raise AssertionError("raw_decode fallback should not be used")
+
+
+def page(tail: bytes) -> FakeResponse:
+    return FakeResponse(b"<html><script>window._init_data_= { data: " + INIT_DATA + tail + b"</script></html>")
+
+
+@pytest.mark.parametrize("tail", [b" }", b" };\n"])
+def test_extract_search_decodes_plain_payload_with_orjson(monkeypatch, tail):
+    monkeypatch.setattr(aliexpress, "_json_decoder", FailingDecoder())
+    fields = aliexpress.extract_search(page(tail))
+    assert fields == {"mods": {"itemList": {"content": []}}, "note": "}"}
+
+
+@pytest.mark.parametrize("tail", [b" }; window.x = 1;", b" } /*!-->init-data-end--*/", b" }; function f(){ return {}; }"])
+def test_extract_search_handles_code_after_payload(tail):
+    fields = aliexpress.extract_search(page(tail))
+    assert fields == {"mods": {"itemList": {"content": []}}, "note": "}"}
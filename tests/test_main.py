@@ -0,0 +1,28 @@
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+
+from app.main import has_search_query
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.aliexpress.com/w/wholesale-iphone-12.html?g=y&SearchText=iphone+12",
+    "https://www.aliexpress.com/w/wholesale-phone.html",
+    "https://www.aliexpress.com/wholesale?SearchText=phone",
+    "https://www.aliexpress.com/wholesale?g=y&SearchText=%41#results",
+])
+def test_has_search_query_accepts_search_urls(url):
+    assert has_search_query(url)
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.aliexpress.com/wholesale?SearchText=+",
+    "https://www.aliexpress.com/wholesale?xSearchText=phone",
+    "https://wholesale-foo.com/",
+    "https://x.com/?q=1#&SearchText=a",
+    "https://x.com/a&SearchText=x",
+])
+def test_has_search_query_rejects_urls_without_a_query(url):
+    assert not has_search_query(url)
+    # scrape_search reads the query with urlparse/parse_qsl, so it must find nothing either
+    assert not dict(parse_qsl(urlparse(url).query)).get('SearchText', '').strip()